@@ -25,10 +25,15 @@
 # **************************************************************************
 
 import pwem
+import getpass
 import os
 from pyworkflow.utils import Environ
+import tempfile
 from .constants import DEEPICT_HOME, VERSION, DEEPICT, DEEPICT_ENV_NAME, \
-DEFAULT_ACTIVATION_CMD, DEEPICT_CUDA_LIB, DEEPICT_ENV_ACTIVATION
+DEFAULT_ACTIVATION_CMD, DEEPICT_CUDA_LIB, DEEPICT_ENV_ACTIVATION, \
+DEEPICT_SCRATCH, DEEPICT_MODELS_REGISTRY, MODELS_REGISTRY_FN, \
+DEEPICT_CALIBRATION, CALIBRATION_FN, MODELS_CACHE_FOLDER
+from .registry import ModelRegistry
 
 _logo = "icon.png"
 _references = ['deteresa2022']
@@ -46,11 +51,60 @@ class Plugin(pwem.Plugin):
         # DeePiCt does NOT need EmVar because it uses a conda environment.
         cls._defineVar(DEEPICT, DEFAULT_ACTIVATION_CMD)
         cls._defineEmVar(DEEPICT_HOME, 'DeePiCt-' + VERSION)
+        cls._defineVar(DEEPICT_SCRATCH, tempfile.gettempdir())
+        cls._defineVar(DEEPICT_MODELS_REGISTRY, '')
+        cls._defineVar(DEEPICT_CALIBRATION, '')
 
     @classmethod
     def getDeepictEnvActivation(cls):
         return cls.getVar(DEEPICT_ENV_ACTIVATION)
 
+    @classmethod
+    def getScratchFolder(cls):
+        """ Node-local folder used to cache models and intermediate files. """
+        return cls.getVar(DEEPICT_SCRATCH) or tempfile.gettempdir()
+
+    @classmethod
+    def getUserScratchFolder(cls, scratch=None):
+        """ Folder of the current user in a scratch folder. The scratch is
+        shared by all the users of the node, so nothing is written directly
+        in it. """
+        try:
+            user = getpass.getuser()
+        except (KeyError, OSError):
+            user = str(os.getuid())
+        return os.path.join(scratch or cls.getScratchFolder(), 'deepict-%s' % user)
+
+    @classmethod
+    def getModelsCacheFolder(cls):
+        """ Node-local copies of the model weights. """
+        return os.path.join(cls.getUserScratchFolder(), MODELS_CACHE_FOLDER)
+
+    @classmethod
+    def getUserDataFolder(cls):
+        """ User-writable folder for the plugin data (the installation folder
+        may be read-only in shared installations). """
+        return os.path.join(os.path.expanduser('~'), '.config', 'deepict')
+
+    @classmethod
+    def getModelsRegistryFile(cls):
+        return cls.getVar(DEEPICT_MODELS_REGISTRY) or \
+               os.path.join(cls.getUserDataFolder(), MODELS_REGISTRY_FN)
+
+    @classmethod
+    def getCalibrationFile(cls):
+        """ Throughput of the DeePiCt stages measured in previous runs. """
+        return cls.getVar(DEEPICT_CALIBRATION) or \
+               os.path.join(cls.getUserDataFolder(), CALIBRATION_FN)
+
+    @classmethod
+    def getModelRegistry(cls):
+        """ Registry with the built-in and the custom DeePiCt models. """
+        # The checksums of the built-in models are those of the packaged weights
+        builtinFolders = [os.path.join(os.path.dirname(__file__), 'models'),
+                          cls.getHome('models')]
+        return ModelRegistry(cls.getModelsRegistryFile(), builtinFolders)
+
     @classmethod
     def getEnviron(cls, gpuId='0'):
         """ Setup the environment variables needed to launch Deepict. """
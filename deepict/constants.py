@@ -6,3 +6,34 @@ DEEPICT_ENV_NAME = '%s-%s' % (DEEPICT, VERSION)
 DEEPICT_ENV_ACTIVATION = 'DEEPICT_ENV_ACTIVATION'
 DEFAULT_ACTIVATION_CMD = 'conda activate %s' % DEEPICT_ENV_NAME
 DEEPICT_CUDA_LIB = 'DEEPICT_CUDA_LIB'
+
+# Node-local scratch area (model cache, intermediate files)
+DEEPICT_SCRATCH = 'DEEPICT_SCRATCH'
+# JSON file listing the custom models registered by the users
+DEEPICT_MODELS_REGISTRY = 'DEEPICT_MODELS_REGISTRY'
+MODELS_REGISTRY_FN = 'models_registry.json'
+MODELS_CACHE_FOLDER = 'deepict_models'
+# JSON file with the per-stage throughput measured in previous runs
+DEEPICT_CALIBRATION = 'DEEPICT_CALIBRATION'
+CALIBRATION_FN = 'calibration.json'
+
+# Models shipped with the plugin: name -> (weights file, sha256)
+MODEL_RIBOSOME = 'ribosome'
+MODEL_MEMBRANE = 'membrane'
+MODEL_MICROTUBULE = 'microtubule'
+MODEL_FAS = 'FAS'
+
+BUILTIN_MODELS = {
+    MODEL_RIBOSOME: ('ribosomeModel.pth',
+                     'a7d6a815c2eafa718aa1e98dcc814bfb61b2f2c57017ab75b820c602cff42d89'),
+    MODEL_MEMBRANE: ('membraneModel.pth',
+                     '5253734bbae73072c3d3f9476059ae19ceb534d73ecdd972e451de082a623b8f'),
+    MODEL_MICROTUBULE: ('microtubuleModel.pth',
+                        '35d7c10e82da5c6ea2fcfcabd337fabbb5998ca1301d22a51377208191932fda'),
+    MODEL_FAS: ('fasModel.pth',
+                'b0d15ac5e7f536eb45752ab8051cd887738c6f718dddf2f6c5c501ae25755f12'),
+}
+
+# Outputs of DeePiCt in the prediction folder of each tomogram
+PROBABILITY_MAP_FN = 'prediction.mrc'
+POST_PROCESSED_FN = 'post_processed_prediction.mrc'
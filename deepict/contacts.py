@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Contact and colocalization analysis between the segmented clusters and a
+region mask.
+
+Instead of dilating the mask voxel-wise for every cluster, the surface voxels
+of the mask are indexed in a KD-tree and queried with the surface voxels and
+the centroids of the clusters, so the cost grows with the number of surface
+points and not with the volume times the contact distance.
+"""
+import csv
+
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+INTERSECTION = 'intersection'
+CONTACT = 'contact'
+COLOCALIZATION = 'colocalization'
+
+CONTACTS_HEADER = ['cluster_id', 'size', 'x', 'y', 'z', 'overlap',
+                   'surface_distance', 'centroid_distance', 'in_contact']
+
+
+def labelClusters(segmentation, connectivity=1):
+    """ Label the connected components of a segmentation (any value > 0). """
+    structure = ndimage.generate_binary_structure(3, connectivity)
+    return ndimage.label(segmentation > 0, structure=structure)
+
+
+def surfacePoints(binary):
+    """ Coordinates (z, y, x) of the voxels of a binary volume that have at
+    least one face neighbour outside of it. """
+    interior = ndimage.binary_erosion(binary, border_value=0)
+    return np.argwhere(binary & ~interior)
+
+
+def computeContacts(labels, numClusters, mask, mode=CONTACT, distance=0):
+    """ Compute the distance table between each cluster and the mask.
+
+    Params:
+        labels: labelled volume (z, y, x), 0 is background.
+        numClusters: number of labels.
+        mask: binary region mask with the same shape as labels.
+        mode: intersection, contact (surface distance) or colocalization
+            (centroid distance).
+        distance: contact distance in voxels.
+    Returns a list of rows following CONTACTS_HEADER.
+    """
+    if labels.shape != mask.shape:
+        raise ValueError("Segmentation %s and mask %s have different shapes"
+                         % (labels.shape, mask.shape))
+    if numClusters == 0:
+        return []
+
+    mask = mask > 0
+    ids = np.arange(1, numClusters + 1)
+    sizes = np.bincount(labels.ravel(), minlength=numClusters + 1)[1:]
+    overlap = np.bincount(labels[mask], minlength=numClusters + 1)[1:]
+    centroids = np.array(ndimage.center_of_mass(labels > 0, labels, ids))
+
+    maskSurface = surfacePoints(mask)
+    if len(maskSurface):
+        tree = cKDTree(maskSurface)
+        # The closest cluster voxel to the mask is always on its surface
+        clusterSurface = surfacePoints(labels > 0)
+        surfaceLabels = labels[tuple(clusterSurface.T)]
+        pointDistance, _ = tree.query(clusterSurface, workers=-1)
+        surfaceDistance = np.full(numClusters, np.inf)
+        np.minimum.at(surfaceDistance, surfaceLabels - 1, pointDistance)
+        centroidDistance, _ = tree.query(centroids, workers=-1)
+    else:
+        surfaceDistance = np.full(numClusters, np.inf)
+        centroidDistance = np.full(numClusters, np.inf)
+    surfaceDistance[overlap > 0] = 0
+    centroidVoxels = np.clip(np.rint(centroids).astype(int), 0,
+                             np.array(mask.shape) - 1)
+    centroidDistance[mask[tuple(centroidVoxels.T)]] = 0
+
+    if mode == INTERSECTION:
+        inContact = overlap > 0
+    elif mode == CONTACT:
+        inContact = surfaceDistance <= distance
+    elif mode == COLOCALIZATION:
+        inContact = centroidDistance <= distance
+    else:
+        raise ValueError("Unknown contact mode %s" % mode)
+
+    rows = []
+    for i in range(numClusters):
+        z, y, x = centroids[i]
+        rows.append([int(ids[i]), int(sizes[i]), x, y, z, int(overlap[i]),
+                     float(surfaceDistance[i]), float(centroidDistance[i]),
+                     int(inContact[i])])
+    return rows
+
+
+def writeContacts(rows, fileName):
+    with open(fileName, 'w', encoding='UTF8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CONTACTS_HEADER)
+        writer.writerows(rows)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Cost estimation of a DeePiCt segmentation run.
+
+Every real run records the time spent by each stage in a calibration file,
+normalized by the amount of work of the stage (voxels or patches). A dry run
+combines those throughputs with the tomogram dimensions, read from the
+headers only, to predict the wall time, GPU-hours, memory and scratch space.
+"""
+import json
+import math
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+import mrcfile
+
+# Geometry of the prediction partition (generate_prediction_partition.py)
+PATCH_BOX = 64
+PATCH_OVERLAP = 12
+
+FLOAT_BYTES = 4
+
+STAGE_SPECTRUM = 'spectrum'
+STAGE_PARTITION = 'partition'
+STAGE_SEGMENT = 'segment'
+STAGE_ASSEMBLE = 'assemble'
+STAGE_POSTPROCESS = 'postprocess'
+
+# Work unit of each stage
+VOXELS = 'voxels'
+PATCHES = 'patches'
+STAGE_UNITS = {STAGE_SPECTRUM: VOXELS,
+               STAGE_PARTITION: PATCHES,
+               STAGE_SEGMENT: PATCHES,
+               STAGE_ASSEMBLE: PATCHES,
+               STAGE_POSTPROCESS: VOXELS}
+
+# Conservative throughputs (units per second) used until a run is recorded
+DEFAULT_THROUGHPUT = {STAGE_SPECTRUM: 2.0e7,
+                      STAGE_PARTITION: 100.0,
+                      STAGE_SEGMENT: 10.0,
+                      STAGE_ASSEMBLE: 200.0,
+                      STAGE_POSTPROCESS: 1.0e7}
+
+# Peak RAM of the DeePiCt scripts per tomogram voxel until a run is recorded
+DEFAULT_RAM_PER_VOXEL = 24
+RAM_PER_VOXEL = 'ram_per_voxel'
+# Activations of the 3D UNet for one patch (features x voxels)
+VRAM_FEATURES_PER_VOXEL = 256
+
+
+def getDimensions(tomogram):
+    """ (x, y, z) of a tomogram, from the set metadata or the mrc header. """
+    dim = tomogram.getDim()
+    if dim and all(dim):
+        return tuple(int(d) for d in dim)
+    with mrcfile.open(tomogram.getFileName(), header_only=True,
+                      permissive=True) as mrc:
+        header = mrc.header
+        return int(header.nx), int(header.ny), int(header.nz)
+
+
+def countPatches(dims, box=PATCH_BOX, overlap=PATCH_OVERLAP):
+    """ Number of patches of the prediction partition of a tomogram. """
+    stride = box - 2 * overlap
+    return int(math.prod(max(1, math.ceil(d / stride)) for d in dims))
+
+
+def readCalibration(calibrationFile):
+    if calibrationFile and os.path.exists(calibrationFile):
+        with open(calibrationFile) as f:
+            return json.load(f)
+    return {}
+
+
+def _writeCalibration(calibration, calibrationFile):
+    os.makedirs(os.path.dirname(os.path.abspath(calibrationFile)),
+                exist_ok=True)
+    tmpFile = calibrationFile + '.tmp%d' % os.getpid()
+    with open(tmpFile, 'w') as f:
+        json.dump(calibration, f, indent=2, sort_keys=True)
+    os.replace(tmpFile, calibrationFile)
+
+
+def childrenPeakRss():
+    """ Max RSS (bytes) of all the finished child processes (KiB in Linux). """
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+def recordStage(calibrationFile, stage, units, seconds, voxels=None,
+                peakRss=None):
+    """ Accumulate the work and time of a stage in the calibration file.
+    peakRss is the peak memory of the stage processes, if it is known. """
+    calibration = readCalibration(calibrationFile)
+    entry = calibration.setdefault(stage, {'units': 0, 'seconds': 0.0})
+    entry['units'] += units
+    entry['seconds'] += seconds
+    if voxels and peakRss:
+        calibration[RAM_PER_VOXEL] = max(calibration.get(RAM_PER_VOXEL, 0),
+                                         peakRss / voxels)
+    try:
+        _writeCalibration(calibration, calibrationFile)
+    except OSError:
+        # The calibration is optional, never fail a run because of it
+        pass
+
+
+@contextmanager
+def stageTimer(calibrationFile, stage, dims):
+    """ Time a stage of a tomogram of these dimensions and record it. """
+    voxels = math.prod(dims)
+    units = voxels if STAGE_UNITS[stage] == VOXELS else countPatches(dims)
+    rssBefore = childrenPeakRss()
+    start = time.time()
+    yield
+    seconds = time.time() - start
+    # The children max RSS covers every process finished so far, it only
+    # measures this stage if the stage raised it
+    rssAfter = childrenPeakRss()
+    peakRss = rssAfter if rssAfter > rssBefore else None
+    recordStage(calibrationFile, stage, units, seconds, voxels, peakRss)
+
+
+def getThroughput(calibration, stage):
+    entry = calibration.get(stage)
+    if entry and entry['seconds'] > 0:
+        return entry['units'] / entry['seconds']
+    return DEFAULT_THROUGHPUT[stage]
+
+
+def estimateTomogram(dims, calibration, weightsBytes=0):
+    """ Predicted cost of segmenting a tomogram of dimensions (x, y, z). """
+    voxels = math.prod(dims)
+    patches = countPatches(dims)
+    work = {VOXELS: voxels, PATCHES: patches}
+    stageSeconds = {stage: work[units] / getThroughput(calibration, stage)
+                    for stage, units in STAGE_UNITS.items()}
+    ramPerVoxel = calibration.get(RAM_PER_VOXEL, DEFAULT_RAM_PER_VOXEL)
+    patchBytes = PATCH_BOX ** 3 * FLOAT_BYTES
+    return {
+        'dims': list(dims),
+        'patches': patches,
+        'seconds': sum(stageSeconds.values()),
+        'gpu_seconds': stageSeconds[STAGE_SEGMENT],
+        'ram_bytes': voxels * ramPerVoxel,
+        'vram_bytes': 2 * weightsBytes + patchBytes * VRAM_FEATURES_PER_VOXEL,
+        # filtered tomogram, partition, raw predictions, assembled and
+        # post-processed predictions
+        'scratch_bytes': 3 * voxels * FLOAT_BYTES + 2 * patches * patchBytes,
+    }
+
+
+def estimateRun(tomograms, calibration, weightsBytes=0):
+    """ Estimate every tomogram and the whole run (steps run one by one). """
+    perTomo = {tsId: estimateTomogram(dims, calibration, weightsBytes)
+               for tsId, dims in tomograms.items()}
+    values = perTomo.values()
+    total = {
+        'tomograms': len(perTomo),
+        'patches': sum(e['patches'] for e in values),
+        'seconds': sum(e['seconds'] for e in values),
+        'gpu_hours': sum(e['gpu_seconds'] for e in values) / 3600.0,
+        'ram_bytes': max((e['ram_bytes'] for e in values), default=0),
+        'vram_bytes': max((e['vram_bytes'] for e in values), default=0),
+        'scratch_bytes': sum(e['scratch_bytes'] for e in values),
+        'calibrated': all(stage in calibration for stage in STAGE_UNITS),
+    }
+    return {'tomograms': perTomo, 'total': total}
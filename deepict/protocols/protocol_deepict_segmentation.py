@@ -26,19 +26,30 @@
 # **************************************************************************
 
 from pyworkflow.protocol import Protocol, params, Integer
-from pyworkflow.utils import Message
+from pyworkflow.utils import Message, prettyDelta, prettySize
 from pyworkflow.protocol import EnumParam, IntParam, FloatParam, BooleanParam, LT, GT
-from pyworkflow.object import Set
+from pyworkflow.object import Set, String, CsvList
 from scipion.constants import PYTHON
 from tomo.objects import Tomogram, SetOfTomograms
 from tomo.protocols import ProtTomoBase
 from pwem.protocols import EMProtocol
 import csv
+import hashlib
+import json
 import os
+import shutil
+from datetime import timedelta
+import mrcfile
 from deepict import Plugin
+from deepict.constants import MODEL_RIBOSOME, MODEL_MEMBRANE, \
+    MODEL_MICROTUBULE, MODEL_FAS, DEEPICT_SCRATCH, \
+    POST_PROCESSED_FN, PROBABILITY_MAP_FN, BUILTIN_MODELS
+from deepict.registry import sha256sum
+from deepict import contacts, estimator, storage
 
 import yaml
 
+
 class DeepictSegmentation(EMProtocol, ProtTomoBase):
     """
     Cryo-electron tomograms capture a wealth of structural information on the molecular constituents
@@ -58,6 +69,17 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
     MEMBRANE    = 1
     MICROTUBULE = 2
     FAS         = 3
+    CUSTOM      = 4
+    REGISTERED  = 5
+
+    MODEL_NAMES = {RIBOSOME: MODEL_RIBOSOME,
+                   MEMBRANE: MODEL_MEMBRANE,
+                   MICROTUBULE: MODEL_MICROTUBULE,
+                   FAS: MODEL_FAS}
+
+    KEEP_ALL            = storage.KEEP_ALL
+    KEEP_FINAL          = storage.KEEP_FINAL
+    KEEP_PROBABILITY    = storage.KEEP_PROBABILITY
 
     INTERSECTION    = 0
     CONTACT         = 1
@@ -67,9 +89,22 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
 
     AMP_SPECTRUM_FN     = 'amp_spectrum.tsv'
     FILTERED_TOMO_FN    = 'match_spectrum_filt.mrc'
+    POST_PROCESSED_FN   = POST_PROCESSED_FN
+    CONTACTS_FN         = 'cluster_distances.csv'
 
     DEEPICT_TEMPORAL_PATH = '/home/kdna/opt/scipion/software/em/DeePiCt-0/DeePiCt/3d_cnn/src'
 
+    def __init__(self, **kwargs):
+        EMProtocol.__init__(self, **kwargs)
+        # Validated (and locally cached) weights used by all the tomograms
+        self.modelPath = String()
+        # Predicted cost of the run (json) when running in dry-run mode
+        self.costEstimate = String()
+        # Tomograms taken unchanged from the previous run
+        self.carriedForward = CsvList()
+        # Registry checksum of the weights used by the run
+        self.modelSha = String()
+
     # -------------------------- DEFINE param functions ----------------------
     def _defineParams(self, form):
         """ Define the input parameters that will be used.
@@ -91,15 +126,55 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
                       allowsNull=True,
                       help='Set of tomo masks that helps the DeePiCt image processing.')
 
+        form.addParam('previousRun', params.PointerParam,
+                      pointerClass='DeepictSegmentation',
+                      label='Previous segmentation',
+                      allowsNull=True,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      help='Previous run of this protocol with the same model and post-processing '
+                           'parameters. Only the tomograms that are new or whose files changed '
+                           '(same tsId but different content) are segmented again; for the rest, '
+                           'the files that the retention policy keeps are copied from the previous run '
+                           '(if the previous run kept them).')
+
         form.addParam('tomogramOption',
                       EnumParam,
-                      choices=['ribosome', 'membrane', 'microtubule', 'FAS'],
+                      choices=['ribosome', 'membrane', 'microtubule', 'FAS', 'custom', 'registered'],
                       default=self.MEMBRANE,
                       label='Resize option',
                       isplay=EnumParam.DISPLAY_COMBO,
                       help='Choose the model based on what you want to segment. \n '
-                           'The available models are prediction for membrane, ribosome, microtubules, and FAS.')
+                           'The available models are prediction for membrane, ribosome, microtubules, and FAS. '
+                           'Choose custom to use your own trained model, or registered to pick a custom '
+                           'model used in a previous run.')
+
+        form.addParam('customModel',
+                      params.PathParam,
+                      condition='tomogramOption == %d' % self.CUSTOM,
+                      label='Custom model weights',
+                      help='Weights (.pth) of a custom trained DeePiCt model. The model is added to the '
+                           'models registry the first time it is used, so later runs check its '
+                           'checksum before segmenting.')
+
+        customModels = Plugin.getModelRegistry().getCustomModels()
+        form.addParam('registeredModel',
+                      params.StringParam,
+                      condition='tomogramOption == %d' % self.REGISTERED,
+                      label='Registered model',
+                      default=customModels[0] if customModels else '',
+                      help='Name of a custom model in the models registry (%s). Registered models: %s'
+                           % (Plugin.getModelsRegistryFile(), ', '.join(customModels) or 'none'))
         
+        form.addParam('dryRun',
+                      BooleanParam,
+                      label='Dry run (estimate cost)',
+                      default=False,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      help='Do not segment anything. Only the headers of the input tomograms are read '
+                           'to predict the wall time, GPU-hours, peak RAM/VRAM and scratch space of the '
+                           'run, using the throughput measured in previous runs. The estimation is shown '
+                           'in the protocol summary.')
+
         form.addSection(label='Post-processing')
         form.addParam('threshold',
                       FloatParam,
@@ -138,14 +213,53 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
                       default=self.INTERSECTION,
                       label='Contact mode',
                       isplay=EnumParam.DISPLAY_COMBO,
-                      help='TODO Choose the model based on what you want to segment. \n '
-                           'The available models are prediction for membrane, ribosome, microtubules, and FAS.')
+                      help='How the clusters are related to the mask (e.g. a membrane segmentation): '
+                           'intersection (overlapping voxels), contact (distance from the cluster '
+                           'surface to the mask) or colocalization (distance from the cluster centroid '
+                           'to the mask). When a mask is given, a per-cluster distance table is written '
+                           'next to the motl.')
         
         form.addParam('contactDistance',
                       IntParam,
                       label='Contact distance',
                       default=0,
-                      help='TODO')
+                      help='Maximum distance (in voxels) between a cluster and the mask to consider '
+                           'them in contact or colocalized.')
+
+        form.addSection(label='Storage')
+        form.addParam('useScratch',
+                      BooleanParam,
+                      label='Use a scratch folder?',
+                      default=False,
+                      help='Write the intermediate files (filtered tomogram, patch partition, raw '
+                           'predictions) to a node-local scratch folder instead of the project. '
+                           'The retained outputs are copied back as each tomogram finishes.')
+
+        form.addParam('scratchFolder',
+                      params.PathParam,
+                      condition='useScratch',
+                      label='Scratch folder',
+                      default='',
+                      help='Node-local folder for the intermediate files. If empty, the %s '
+                           'variable of the plugin (or the system temporary folder) is used. '
+                           'The files of a tomogram are removed from it as soon as the tomogram '
+                           'finishes. If the run fails, they are kept so it can be continued, and '
+                           'they are cleaned when the run finishes; delete the run folder under '
+                           '<scratch>/deepict-<user>/<project> by hand if a failed run is not continued.'
+                           % DEEPICT_SCRATCH)
+
+        form.addParam('retentionPolicy',
+                      EnumParam,
+                      choices=['keep all', 'keep final', 'keep probability maps'],
+                      default=self.KEEP_ALL,
+                      label='Intermediate files',
+                      display=EnumParam.DISPLAY_COMBO,
+                      help='Files kept for each tomogram once it has been processed:\n'
+                           'keep all: every intermediate file.\n'
+                           'keep final: the post-processed prediction and the tables (motl, '
+                           'cluster distances).\n'
+                           'keep probability maps: the final outputs plus the assembled '
+                           'probability maps.')
 
 
         form.addHidden(params.GPU_LIST,
@@ -162,8 +276,21 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
         inTomogram = self.inputTomogram.get()
         inMask = self.inputMask.get()
 
+        if self.dryRun.get():
+            self._insertFunctionStep(self.estimateCostStep)
+            return
+
+        previousOutputs = self.getPreviousOutputs()
+
+        self._insertFunctionStep(self.preloadModelStep)
         for tom in inTomogram:
             tomId = tom.getObjId()
+            prevFingerprint = previousOutputs.get(tom.getTsId())
+            if prevFingerprint is not None and prevFingerprint == self.getFingerprint(tom):
+                self._insertFunctionStep(self.carryForwardStep, tomId)
+                self._insertFunctionStep(self.createOutputStep, tomId)
+                continue
+
             self._insertFunctionStep(self.setupFolderStep, inTomogram, tomId)
             self._insertFunctionStep(self.spectrumStep, inTomogram, tomId)
             self._insertFunctionStep(self.createConfigFiles, inTomogram, tomId)
@@ -171,17 +298,64 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
             self._insertFunctionStep(self.segmentStep, inTomogram, tomId)
             self._insertFunctionStep(self.assemblePredictionStep, inTomogram, tomId)
             self._insertFunctionStep(self.postProcessingStep, inTomogram, tomId)
+            if inMask is not None:
+                self._insertFunctionStep(self.contactAnalysisStep, inTomogram, tomId)
+            self._insertFunctionStep(self.retainOutputsStep, inTomogram, tomId)
             self._insertFunctionStep(self.createOutputStep, tomId)
         self._insertFunctionStep(self.closeOutputSetsStep)
 
+    def preloadModelStep(self):
+        """ Validate the selected model once per run and copy it to the
+        node-local scratch, so segment.py does not read it from the shared
+        storage for every tomogram. """
+        registry = Plugin.getModelRegistry()
+        modelName = self.getModelName(registry)
+        self.modelPath.set(registry.cache(modelName, Plugin.getModelsCacheFolder()))
+        self.modelSha.set(registry.getModel(modelName)['sha256'])
+        self._store(self.modelPath, self.modelSha)
+
+    def estimateCostStep(self):
+        tomograms = {tom.getTsId(): estimator.getDimensions(tom)
+                     for tom in self.inputTomogram.get()}
+        calibration = estimator.readCalibration(Plugin.getCalibrationFile())
+        weightsBytes = 0
+        weights = self.getSelectedWeights()
+        if weights and os.path.exists(weights):
+            weightsBytes = os.path.getsize(weights)
+
+        self.costEstimate.set(json.dumps(estimator.estimateRun(tomograms, calibration, weightsBytes)))
+        self._store(self.costEstimate)
+
+    def stageTimer(self, inputTom, tomId, stage):
+        """ Record the time of a stage to calibrate later dry runs. """
+        return estimator.stageTimer(Plugin.getCalibrationFile(), stage,
+                                    estimator.getDimensions(inputTom[tomId]))
+
+    def carryForwardStep(self, tsObjId):
+        """ Take the results of an unchanged tomogram from the previous run. """
+        tsId = self.inputTomogram.get()[tsObjId].getTsId()
+        previous = self.previousRun.get()
+        policy = self.retentionPolicy.get()
+        copied = storage.copyRetainedFiles(previous._getExtraPath(tsId),
+                                           previous.getPredictionFolder(tsId),
+                                           self._getExtraPath(tsId),
+                                           self.getPredictionFolder(tsId), policy)
+        if policy != self.KEEP_FINAL and \
+                PROBABILITY_MAP_FN not in {os.path.basename(fn) for fn in copied}:
+            self.info('The previous run did not keep the probability map of %s, '
+                      'it will not be available for this tomogram' % tsId)
+        if tsId not in self.carriedForward:
+            self.carriedForward.append(tsId)
+            self._store(self.carriedForward)
+
     def setupFolderStep(self, inputTom, tomId):
         # Obtaining the ts and the tsId
         ts = inputTom[tomId]
         tsId = ts.getTsId()
 
-        # Creating the tomogram folder
-        tomoPath = self._getExtraPath(tsId)
-        os.mkdir(tomoPath)
+        # Creating the tomogram folder (and its work folder in the scratch)
+        os.makedirs(self._getExtraPath(tsId), exist_ok=True)
+        os.makedirs(self.getWorkFolder(tsId), exist_ok=True)
 
 
     def spectrumStep(self, inputTom, tomId):
@@ -189,11 +363,12 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
         target_spectrum = os.path.join(self.getTsIdFolder(inputTom, tomId), self.AMP_SPECTRUM_FN)
         filtered_tomo = os.path.join(self.getTsIdFolder(inputTom, tomId), self.FILTERED_TOMO_FN)
 
-        Plugin.runDeepict(self, PYTHON, 'DeePiCt/spectrum_filter/extract_spectrum.py --input %s --output %s'
-                        % (input_tomo, target_spectrum))
+        with self.stageTimer(inputTom, tomId, estimator.STAGE_SPECTRUM):
+            Plugin.runDeepict(self, PYTHON, 'DeePiCt/spectrum_filter/extract_spectrum.py --input %s --output %s'
+                            % (input_tomo, target_spectrum))
 
-        Plugin.runDeepict(self, PYTHON, 'DeePiCt/spectrum_filter/match_spectrum.py --input %s --target %s --output %s'
-                          % (input_tomo, target_spectrum, filtered_tomo))
+            Plugin.runDeepict(self, PYTHON, 'DeePiCt/spectrum_filter/match_spectrum.py --input %s --target %s --output %s'
+                              % (input_tomo, target_spectrum, filtered_tomo))
 
 
     #TODO create new steps (notebook section 3)
@@ -203,24 +378,27 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
         pathPython = os.path.join(Plugin.getHome(), 'DeePiCt/3d_cnn/src')
         tomo_name = inputTom[tomId].getTsId()
 
-        Plugin.runDeepict(self, PYTHON, 'DeePiCt/3d_cnn/scripts/generate_prediction_partition.py --config_file %s --pythonpath %s --tomo_name %s'
-                        % (fnConfig, pathPython, tomo_name))
+        with self.stageTimer(inputTom, tomId, estimator.STAGE_PARTITION):
+            Plugin.runDeepict(self, PYTHON, 'DeePiCt/3d_cnn/scripts/generate_prediction_partition.py --config_file %s --pythonpath %s --tomo_name %s'
+                            % (fnConfig, pathPython, tomo_name))
 
 
     def segmentStep(self, inputTom, tomId):
         tsid = inputTom[tomId].getTsId()
 
-        Plugin.runDeepict(self, PYTHON, 'DeePiCt/3d_cnn/scripts/segment.py --config_file %s --pythonpath %s --tomo_name %s --gpu %i'
-                        % (os.path.join(self.getTsIdFolder(inputTom, tomId), 'config.yaml'),
-                           os.path.join(Plugin.getHome(), 'DeePiCt/3d_cnn/src'),
-                           tsid, self.getGpuList()[0]))
+        with self.stageTimer(inputTom, tomId, estimator.STAGE_SEGMENT):
+            Plugin.runDeepict(self, PYTHON, 'DeePiCt/3d_cnn/scripts/segment.py --config_file %s --pythonpath %s --tomo_name %s --gpu %i'
+                            % (os.path.join(self.getTsIdFolder(inputTom, tomId), 'config.yaml'),
+                               os.path.join(Plugin.getHome(), 'DeePiCt/3d_cnn/src'),
+                               tsid, self.getGpuList()[0]))
 
     def assemblePredictionStep(self, inputTom, tomId):
         tsid = inputTom[tomId].getTsId()
         # Assemnble the segmentated patches
-        Plugin.runDeepict(self, PYTHON, 'DeePiCt/3d_cnn/scripts/assemble_prediction.py --config_file %s --pythonpath %s --tomo_name %s'
-                          % (os.path.join(self.getTsIdFolder(inputTom, tomId), 'config.yaml'),
-                             os.path.join(Plugin.getHome(), 'DeePiCt/3d_cnn/src'), tsid))
+        with self.stageTimer(inputTom, tomId, estimator.STAGE_ASSEMBLE):
+            Plugin.runDeepict(self, PYTHON, 'DeePiCt/3d_cnn/scripts/assemble_prediction.py --config_file %s --pythonpath %s --tomo_name %s'
+                              % (os.path.join(self.getTsIdFolder(inputTom, tomId), 'config.yaml'),
+                                 os.path.join(Plugin.getHome(), 'DeePiCt/3d_cnn/src'), tsid))
 
     def read_yaml(self, file_path):
         with open(file_path, "r") as stream:
@@ -237,14 +415,7 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
         if self.maxClusterSize.get() != 0:
             max_cluster_size = self.maxClusterSize.get()
 
-        ctMOpt = self.contactMode.get()
-
-        if ctMOpt == self.INTERSECTION:
-            contact_mode = 'intersection'
-        elif ctMOpt == self.CONTACT:
-            contact_mode = 'contact'
-        elif ctMOpt == self.COLOCALIZATION:
-            contact_mode = 'colocalization'
+        contact_mode = self.getContactMode()
 
         d['postprocessing_clustering']['active'] = True
         d['postprocessing_clustering']['threshold'] = self.threshold.get()
@@ -254,39 +425,197 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
         d['postprocessing_clustering']['calculate_motl'] = self.calculateMotl.get()
         d['postprocessing_clustering']['ignore_border_thickness'] = 0
         d['postprocessing_clustering']['region_mask'] = 'no_mask'
+        if self.inputMask.get() is not None:
+            # Contacts are computed by contactAnalysisStep on a spatial index
+            contact_mode = contacts.INTERSECTION
+            contact_distance = 0
+        else:
+            contact_distance = self.contactDistance.get()
         d['postprocessing_clustering']['contact_mode'] = contact_mode
-        d['postprocessing_clustering']['contact_distance'] = self.contactDistance.get()
+        d['postprocessing_clustering']['contact_distance'] = contact_distance
 
         self.save_yaml(d, user_config_file)
 
         tsid = inputTom[tomId].getTsId()
 
-        Plugin.runDeepict(self, PYTHON, 'DeePiCt/3d_cnn/scripts/clustering_and_cleaning.py --config_file %s --pythonpath %s --tomo_name %s'
-                          % (user_config_file, os.path.join(Plugin.getHome(), 'DeePiCt/3d_cnn/src'), tsid))
+        with self.stageTimer(inputTom, tomId, estimator.STAGE_POSTPROCESS):
+            Plugin.runDeepict(self, PYTHON, 'DeePiCt/3d_cnn/scripts/clustering_and_cleaning.py --config_file %s --pythonpath %s --tomo_name %s'
+                              % (user_config_file, os.path.join(Plugin.getHome(), 'DeePiCt/3d_cnn/src'), tsid))
 
 
-    def getTsIdFolder(self, inputTom, tomId):
-        ts = inputTom[tomId]
-        tsId = ts.getTsId()
+    def contactAnalysisStep(self, inputTom, tomId):
+        tsId = inputTom[tomId].getTsId()
+        maskFn = self.getMaskFileName(tsId)
+        if maskFn is None:
+            self.info('No mask found for %s, skipping the contact analysis' % tsId)
+            return
 
-        #Defining the output folder
-        tomoPath = self._getExtraPath(tsId)
-        return tomoPath
+        predFolder = self.getPredictionFolder(tsId, self.getWorkFolder(tsId))
+        with mrcfile.mmap(os.path.join(predFolder, self.POST_PROCESSED_FN), mode='r') as mrc:
+            labels, numClusters = contacts.labelClusters(mrc.data,
+                                                         self.clusteringConnectivity.get())
+        with mrcfile.mmap(maskFn, mode='r') as mrc:
+            mask = mrc.data > 0
 
+        rows = contacts.computeContacts(labels, numClusters, mask,
+                                        mode=self.getContactMode(),
+                                        distance=self.contactDistance.get())
+        contacts.writeContacts(rows, os.path.join(predFolder, self.CONTACTS_FN))
 
-    def getModel(self):
+    def getContactMode(self):
+        ctMOpt = self.contactMode.get()
+
+        if ctMOpt == self.INTERSECTION:
+            contact_mode = contacts.INTERSECTION
+        elif ctMOpt == self.CONTACT:
+            contact_mode = contacts.CONTACT
+        elif ctMOpt == self.COLOCALIZATION:
+            contact_mode = contacts.COLOCALIZATION
+
+        return contact_mode
+
+    def getMaskFileName(self, tsId):
+        for mask in self.inputMask.get():
+            if mask.getTsId() == tsId:
+                return mask.getFileName()
+        return None
+
+    def retainOutputsStep(self, inputTom, tomId):
+        """ Apply the retention policy to the files of a finished tomogram and
+        bring the retained ones back from the scratch folder. """
+        tsId = inputTom[tomId].getTsId()
+        workFolder = self.getWorkFolder(tsId)
+        keep = storage.getRetainedFiles(workFolder, self.getPredictionFolder(tsId, workFolder),
+                                        self.retentionPolicy.get())
+        storage.retainFiles(workFolder, self._getExtraPath(tsId), keep)
+
+    def getPredictionFolder(self, tsId, folder=None):
+        """ Folder where DeePiCt writes the post-processed prediction and the motl. """
+        typeOfModel = os.path.split(os.path.splitext(self.modelPath.get())[0])[1]
+        folder = folder or self._getExtraPath(tsId)
+        return os.path.join(folder, 'predictions', typeOfModel, tsId, 'memb')
+
+    def getWorkFolder(self, tsId):
+        """ Folder for the intermediate files of a tomogram: the node-local
+        scratch if requested, the extra folder otherwise. """
+        if not self.useScratch.get():
+            return self._getExtraPath(tsId)
+        return os.path.join(self.getScratchRunFolder(), tsId)
+
+    def getScratchRunFolder(self):
+        scratch = Plugin.getUserScratchFolder(self.scratchFolder.get())
+        return os.path.join(scratch, self.getProject().getShortName(), self.getWorkingDir())
+
+    def getFingerprint(self, tomogram):
+        """ Identify the input of a tomogram by its tsId and the content of
+        its files (tomogram and mask). """
+        tsId = tomogram.getTsId()
+        fingerprint = hashlib.sha256(tsId.encode())
+        files = [tomogram.getFileName()]
+        if self.inputMask.get() is not None:
+            files.append(self.getMaskFileName(tsId))
+        for fn in files:
+            if fn is None:
+                continue
+            if not os.path.exists(fn):
+                raise FileNotFoundError('Input file of %s not found: %s' % (tsId, fn))
+            fingerprint.update(storage.fileFingerprint(fn).encode())
+        return fingerprint.hexdigest()
+
+    def getSelectedWeights(self):
+        """ Weights file of the selected model (None if it is not registered). """
+        tomoOpt = self.tomogramOption.get()
+        if tomoOpt == self.CUSTOM:
+            return self.customModel.get()
+        registry = Plugin.getModelRegistry()
+        modelName = self.registeredModel.get() if tomoOpt == self.REGISTERED \
+            else self.MODEL_NAMES[tomoOpt]
+        if modelName not in registry.getModels():
+            return None
+        return registry.getModel(modelName)['file']
+
+    def getSelectedModelSha(self):
+        """ Checksum of the weights that a new run would use. """
         tomoOpt = self.tomogramOption.get()
+        if tomoOpt in self.MODEL_NAMES:
+            return BUILTIN_MODELS[self.MODEL_NAMES[tomoOpt]][1]
+        weights = self.getSelectedWeights()
+        return sha256sum(weights) if weights and os.path.exists(weights) else None
+
+    def getRunSignature(self, modelSha):
+        """ Model and parameters that must match to reuse the results of
+        another run. """
+        return (modelSha,
+                self.threshold.get(), self.minClusterSize.get(),
+                self.maxClusterSize.get(), self.clusteringConnectivity.get(),
+                self.calculateMotl.get(), self.contactMode.get(),
+                self.contactDistance.get(), self.inputMask.get() is not None)
+
+    def isPreviousRunReusable(self):
+        """ True if the previous run used the same weights and parameters. """
+        previous = self.previousRun.get()
+        if previous is None or not previous.modelSha.get():
+            return False
+        return (previous.getRunSignature(previous.modelSha.get())
+                == self.getRunSignature(self.getSelectedModelSha()))
+
+    def getPreviousOutputs(self):
+        """ Fingerprints (by tsId) of the tomograms segmented by the previous
+        run, if its results can be reused. """
+        if not self.isPreviousRunReusable():
+            return {}
+        prevOutput = getattr(self.previousRun.get(), self.OUTPUT_TOMOGRAMS_NAME, None)
+        if prevOutput is None:
+            return {}
+        return {tomo.getTsId(): tomo._deepictFingerprint.get()
+                for tomo in prevOutput if hasattr(tomo, '_deepictFingerprint')}
 
-        if tomoOpt == self.MEMBRANE:
-            modelWeights = os.path.join('models', 'membraneModel.pth')
-        elif tomoOpt == self.MICROTUBULE:
-            modelWeights = os.path.join('models', 'microtubuleModel.pth')
-        elif tomoOpt == self.RIBOSOME:
-            modelWeights = os.path.join('models', 'ribosomeModel.pth')
-        elif tomoOpt == self.FAS:
-            modelWeights = os.path.join('models', 'fasModel.pth')
+    def getTsIdFolder(self, inputTom, tomId):
+        return self.getWorkFolder(inputTom[tomId].getTsId())
+
+
+    def getModelName(self, registry):
+        """ Name of the selected model in the registry. Custom weights are
+        registered (with their checksum) the first time they are used. """
+        tomoOpt = self.tomogramOption.get()
+        if tomoOpt in self.MODEL_NAMES:
+            return self.MODEL_NAMES[tomoOpt]
 
-        return modelWeights
+        if tomoOpt == self.REGISTERED:
+            modelName = self.registeredModel.get()
+        else:
+            weights = self.customModel.get()
+            modelName = registry.findByFile(weights)
+            if modelName is None:
+                sha = sha256sum(weights)
+                modelName = os.path.splitext(os.path.basename(weights))[0]
+                if modelName in registry.getModels():
+                    modelName += '_' + sha[:8]
+                registry.register(modelName, weights, sha256=sha)
+                return modelName
+
+        if registry.isStale(modelName):
+            # Retrained at the same path: register the new checksum
+            self.info('Weights of model %s changed, registering them again' % modelName)
+            registry.register(modelName, registry.getModel(modelName)['file'])
+        return modelName
+
+    def getModel(self):
+        """ Path of the weights used for the segmentation. The cached copy is
+        made again if it is missing (e.g. the run was continued on another
+        node or the scratch was purged). """
+        modelPath = self.modelPath.get()
+        if not os.path.exists(modelPath):
+            registry = Plugin.getModelRegistry()
+            modelName = self.getModelName(registry)
+            if registry.getModel(modelName)['sha256'] != self.modelSha.get():
+                raise ValueError('The weights of model %s changed since the run started, '
+                                 'restart the run to segment all the tomograms with the '
+                                 'same weights.' % modelName)
+            modelPath = registry.cache(modelName, Plugin.getModelsCacheFolder())
+            self.modelPath.set(modelPath)
+            self._store(self.modelPath)
+        return modelPath
 
     def save_yaml(self, data, file_path):
         with open(file_path, 'w') as yaml_file:
@@ -295,7 +624,7 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
 
     def createConfigFiles(self, inputTom, tomId):
 
-        model_path = os.path.join(Plugin.getHome(), self.getModel())
+        model_path = self.getModel()
 
         tomo_name = inputTom[tomId].getTsId()
         tomogram_path = os.path.join(self.getTsIdFolder(inputTom, tomId), self.FILTERED_TOMO_FN)
@@ -368,22 +697,19 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
         ts = self.inputTomogram.get()[tsObjId]
         tsId = ts.getTsId()
 
-        typeOfModel = os.path.split(os.path.splitext(self.getModel())[0])[1]
-
-        predfolder = os.path.join('predictions', typeOfModel, tsId, 'memb')
-        outputSeg = os.path.join(self._getExtraPath(tsId), predfolder)
+        outputSeg = self.getPredictionFolder(tsId)
 
         output = self.getOutputSetOfTomograms(self.inputTomogram.get())
 
         newTomogram = Tomogram()
-        newTomogram.setLocation(os.path.join(outputSeg,
-                                             'post_processed_prediction.mrc'))
+        newTomogram.setLocation(os.path.join(outputSeg, self.POST_PROCESSED_FN))
         newTomogram.setTsId(tsId)
         newTomogram.setSamplingRate(ts.getSamplingRate())
 
         # Set default tomogram origin
         newTomogram.setOrigin(newOrigin=None)
         newTomogram.setAcquisition(ts.getAcquisition())
+        newTomogram._deepictFingerprint = String(self.getFingerprint(ts))
 
         output.append(newTomogram)
         output.update(newTomogram)
@@ -391,20 +717,73 @@ class DeepictSegmentation(EMProtocol, ProtTomoBase):
         self._store()
 
     def closeOutputSetsStep(self):
+        if self.useScratch.get() and os.path.exists(self.getScratchRunFolder()):
+            # Leftovers of steps that failed before a continue
+            shutil.rmtree(self.getScratchRunFolder())
         self.Tomograms.setStreamState(Set.STREAM_CLOSED)
         self.Tomograms.write()
         self._store()
 
 
     # --------------------------- INFO functions -----------------------------------
+    def _warnings(self):
+        warnings = []
+        previous = self.previousRun.get()
+        if previous is not None and not self.isPreviousRunReusable():
+            warnings.append('The previous segmentation used different model weights or parameters, '
+                            'all the tomograms will be segmented again.')
+        elif previous is not None and (storage.POLICIES.index(previous.retentionPolicy.get())
+                                       < storage.POLICIES.index(self.retentionPolicy.get())):
+            warnings.append('The previous segmentation kept fewer intermediate files, the '
+                            'tomograms taken from it will only have the files it kept (e.g. no '
+                            'probability map to show in the viewer).')
+        return warnings
+
+    def _validate(self):
+        errors = []
+        if self.tomogramOption.get() == self.CUSTOM:
+            weights = self.customModel.get()
+            if not weights or not os.path.exists(weights):
+                errors.append('The weights of the custom model do not exist: %s' % weights)
+        elif self.tomogramOption.get() == self.REGISTERED:
+            customModels = Plugin.getModelRegistry().getCustomModels()
+            if self.registeredModel.get() not in customModels:
+                errors.append('Model %s is not registered. Registered models: %s'
+                              % (self.registeredModel.get(), ', '.join(customModels) or 'none'))
+        return errors
+
     def _summary(self):
         """ Summarize what the protocol has done"""
         summary = []
 
+        if self.dryRun.get():
+            if self.costEstimate.get():
+                summary.extend(self._costSummary(json.loads(self.costEstimate.get())))
+            return summary
+
         if self.isFinished():
             summary.append("A set of %s tomograms have been segmented with deepict using a %s model" % (self.inputTomogram.get().getSize(), self.times))
+        if self.carriedForward:
+            summary.append("%d unchanged tomograms were taken from the previous segmentation"
+                           % len(self.carriedForward))
         return summary
 
+    def _costSummary(self, estimate):
+        total = estimate['total']
+        lines = ['Dry run: estimated cost of segmenting %d tomograms (%d patches)%s'
+                 % (total['tomograms'], total['patches'],
+                    '' if total['calibrated'] else ' using default throughputs (no previous runs recorded)'),
+                 'Wall time: %s, GPU-hours: %.2f' % (prettyDelta(timedelta(seconds=total['seconds'])), total['gpu_hours']),
+                 'Peak RAM: %s, peak VRAM: %s, scratch: %s'
+                 % (prettySize(total['ram_bytes']), prettySize(total['vram_bytes']),
+                    prettySize(total['scratch_bytes']))]
+        for tsId, tomo in estimate['tomograms'].items():
+            lines.append('  %s %s: %d patches, %s, RAM %s, scratch %s'
+                         % (tsId, 'x'.join(str(d) for d in tomo['dims']), tomo['patches'],
+                            prettyDelta(timedelta(seconds=tomo['seconds'])), prettySize(tomo['ram_bytes']),
+                            prettySize(tomo['scratch_bytes'])))
+        return lines
+
     def _methods(self):
         methods = []
 
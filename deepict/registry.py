@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Registry of the DeePiCt model weights.
+
+The models shipped with the plugin are always available. Custom trained
+models are kept in a json file (see Plugin.getModelsRegistryFile) together
+with their checksum, so corrupted weights are detected before the first
+tomogram is segmented.
+"""
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+
+from .constants import BUILTIN_MODELS
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def sha256sum(fileName):
+    """ Compute the sha256 checksum of a file, reading it by chunks. """
+    digest = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checkWeightsFile(fileName):
+    """ Check that a .pth file is a readable torch checkpoint.
+    Torch checkpoints are zip archives, so the CRC of every member is
+    verified without the need of loading torch.
+    """
+    if not os.path.exists(fileName):
+        raise FileNotFoundError("Model weights %s not found" % fileName)
+    if zipfile.is_zipfile(fileName):
+        with zipfile.ZipFile(fileName) as zf:
+            badMember = zf.testzip()
+        if badMember is not None:
+            raise ValueError("Model weights %s are corrupted (bad member %s)"
+                             % (fileName, badMember))
+
+
+def fileStamp(fileName):
+    """ Size and modification time of a file, to detect retrained weights. """
+    stat = os.stat(fileName)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ModelRegistry:
+    """ Available DeePiCt models: name -> {'file': path, 'sha256': checksum}.
+    Custom models also record the size and modification time of their file
+    when they were registered. """
+
+    def __init__(self, registryFile, builtinFolders):
+        self.registryFile = registryFile
+        self.builtinFolders = builtinFolders
+        # Models registered while the registry file is not writable
+        self._volatile = {}
+
+    def _findBuiltin(self, fileName):
+        for folder in self.builtinFolders:
+            path = os.path.join(folder, fileName)
+            if os.path.exists(path):
+                return path
+        return os.path.join(self.builtinFolders[0], fileName)
+
+    def _readCustom(self):
+        if self.registryFile and os.path.exists(self.registryFile):
+            with open(self.registryFile) as f:
+                return json.load(f)
+        return {}
+
+    def getModels(self):
+        """ Return a dict with all the registered models. """
+        models = {name: {'file': self._findBuiltin(fn), 'sha256': sha}
+                  for name, (fn, sha) in BUILTIN_MODELS.items()}
+        models.update(self._readCustom())
+        models.update(self._volatile)
+        return models
+
+    def getCustomModels(self):
+        """ Return the names of the registered custom models. """
+        return sorted(name for name in self.getModels()
+                      if name not in BUILTIN_MODELS)
+
+    def getModel(self, name):
+        models = self.getModels()
+        if name not in models:
+            raise KeyError("Model %s is not registered. Available models: %s"
+                           % (name, ', '.join(sorted(models))))
+        return models[name]
+
+    def findByFile(self, fileName):
+        """ Return the name of the model registered with this weights file. """
+        fileName = os.path.abspath(fileName)
+        for name, model in self.getModels().items():
+            if os.path.abspath(model['file']) == fileName:
+                return name
+        return None
+
+    def isStale(self, name):
+        """ True if the file of a custom model changed since it was registered
+        (e.g. the model was retrained and saved at the same path). """
+        model = self.getModel(name)
+        if name in BUILTIN_MODELS or 'size' not in model:
+            return False
+        return fileStamp(model['file']) != (model['size'], model['mtime'])
+
+    def register(self, name, fileName, sha256=None):
+        """ Add a custom model to the registry (computing its checksum). If the
+        registry file cannot be written, the model is only registered for this
+        registry instance. """
+        if name in BUILTIN_MODELS:
+            raise ValueError("Model name %s is reserved for a built-in model"
+                             % name)
+        checkWeightsFile(fileName)
+        size, mtime = fileStamp(fileName)
+        model = {'file': os.path.abspath(fileName),
+                 'sha256': sha256 or sha256sum(fileName),
+                 'size': size, 'mtime': mtime}
+        try:
+            custom = self._readCustom()
+            custom[name] = model
+            os.makedirs(os.path.dirname(os.path.abspath(self.registryFile)),
+                        exist_ok=True)
+            tmpFile = self.registryFile + '.tmp%d' % os.getpid()
+            with open(tmpFile, 'w') as f:
+                json.dump(custom, f, indent=2, sort_keys=True)
+            os.replace(tmpFile, self.registryFile)
+        except OSError:
+            self._volatile[name] = model
+        return model
+
+    def _checkCopy(self, name, fileName, source):
+        """ Check that a copy of the weights of a model matches its checksum. """
+        model = self.getModel(name)
+        sha = sha256sum(fileName)
+        if sha != model['sha256']:
+            if name in BUILTIN_MODELS:
+                hint = ("Built-in models cannot be replaced, reinstall the "
+                        "plugin to restore them or use the weights as a "
+                        "custom model.")
+            else:
+                hint = ("The weights are corrupted or were modified without "
+                        "updating their size or date; register the model "
+                        "again if the change is intended.")
+            raise ValueError("Checksum mismatch for model %s (%s): expected "
+                             "%s, found %s. %s" % (name, source,
+                                                   model['sha256'], sha, hint))
+        checkWeightsFile(fileName)
+
+    def cache(self, name, cacheFolder):
+        """ Copy the weights of a model to a (node-local) cache folder and
+        return the path of the cached copy. The weights keep their file name
+        since DeePiCt names the prediction folders after it. Both a reused and
+        a new copy must match the registered checksum. If the cache cannot be
+        written, the verified registered file is returned instead.
+        """
+        model = self.getModel(name)
+        source = model['file']
+        if not os.path.exists(source):
+            raise FileNotFoundError("Weights of model %s not found: %s"
+                                    % (name, source))
+        folder = os.path.join(cacheFolder, model['sha256'][:16])
+        cached = os.path.join(folder, os.path.basename(source))
+        if os.path.exists(cached) and sha256sum(cached) == model['sha256']:
+            checkWeightsFile(cached)
+            return cached
+
+        tmpFile = cached + '.tmp%d' % os.getpid()
+        try:
+            try:
+                os.makedirs(folder, exist_ok=True)
+                shutil.copyfile(source, tmpFile)
+            except OSError:
+                # The cache only saves reads from the shared storage
+                self._checkCopy(name, source, source)
+                return source
+            self._checkCopy(name, tmpFile, source)
+            os.replace(tmpFile, cached)
+        finally:
+            if os.path.exists(tmpFile):
+                os.remove(tmpFile)
+        return cached
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Placement and retention of the files produced for each tomogram.
+
+The intermediate files of a tomogram are written to a work folder (the
+extra folder of the protocol or a node-local scratch). Once the tomogram is
+finished, only the files selected by the retention policy are kept in the
+output folder.
+"""
+import hashlib
+import os
+import shutil
+
+from .constants import POST_PROCESSED_FN, PROBABILITY_MAP_FN
+
+KEEP_ALL = 0
+KEEP_FINAL = 1
+KEEP_PROBABILITY = 2
+
+# Policies from the one that keeps the fewest files to the one that keeps most
+POLICIES = [KEEP_FINAL, KEEP_PROBABILITY, KEEP_ALL]
+
+
+def getRetainedFiles(workFolder, predFolder, policy):
+    """ Files of the work folder (relative paths) to keep with a policy.
+    predFolder is the folder with the post-processed prediction and tables. """
+    keep = set()
+    if policy == KEEP_ALL:
+        for root, dirs, files in os.walk(workFolder):
+            keep.update(os.path.relpath(os.path.join(root, fn), workFolder)
+                        for fn in files)
+        return keep
+
+    for fn in os.listdir(predFolder):
+        isFinal = fn == POST_PROCESSED_FN or fn.endswith('.csv')
+        isProbability = fn == PROBABILITY_MAP_FN
+        if isFinal or (isProbability and policy == KEEP_PROBABILITY):
+            keep.add(os.path.relpath(os.path.join(predFolder, fn), workFolder))
+    return keep
+
+
+def retainFiles(workFolder, outputFolder, keep):
+    """ Leave only the kept files in the output folder. When the work folder
+    is a scratch folder, they are copied to the output and the work folder is
+    removed. """
+    if os.path.abspath(workFolder) != os.path.abspath(outputFolder):
+        for relPath in keep:
+            dest = os.path.join(outputFolder, relPath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(os.path.join(workFolder, relPath), dest)
+        shutil.rmtree(workFolder)
+        return
+
+    for root, dirs, files in os.walk(workFolder, topdown=False):
+        for fn in files:
+            path = os.path.join(root, fn)
+            if os.path.relpath(path, workFolder) not in keep:
+                os.remove(path)
+        if root != workFolder and not os.listdir(root):
+            os.rmdir(root)
+
+
+# Content sampled to fingerprint a file: mrc header plus evenly spaced blocks
+FINGERPRINT_HEADER = 1024
+FINGERPRINT_BLOCKS = 16
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+
+def fileFingerprint(fileName):
+    """ Fingerprint of the content of a (large) file: its size, the mrc header
+    and a few blocks sampled along the file. It does not depend on the path
+    or modification time, so a file rewritten with the same content (or
+    copied elsewhere) keeps its fingerprint. Files larger than the sampled
+    bytes are not read completely: a change of the same size confined to the
+    regions between the sampled blocks is not detected. """
+    size = os.path.getsize(fileName)
+    digest = hashlib.sha256(str(size).encode())
+    with open(fileName, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_HEADER))
+        for i in range(FINGERPRINT_BLOCKS):
+            f.seek(i * max(0, size - FINGERPRINT_BLOCK_SIZE) // max(1, FINGERPRINT_BLOCKS - 1))
+            digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def copyRetainedFiles(workFolder, predFolder, outputFolder, outputPredFolder,
+                      policy):
+    """ Copy (never link, the source may be rewritten later) the files of a
+    tomogram kept by another run that a policy keeps. The files of predFolder
+    go to outputPredFolder, since both are named after the weights file.
+    Return the relative paths (to workFolder) of the copied files. """
+    keep = getRetainedFiles(workFolder, predFolder, policy)
+    predRelPath = os.path.relpath(predFolder, workFolder)
+    for relPath in keep:
+        if os.path.dirname(relPath) == predRelPath:
+            dest = os.path.join(outputPredFolder, os.path.basename(relPath))
+        else:
+            dest = os.path.join(outputFolder, relPath)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(os.path.join(workFolder, relPath), dest)
+    return keep
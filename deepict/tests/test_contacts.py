@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import numpy as np
+from scipy import ndimage
+from pyworkflow.tests import BaseTest
+
+from deepict import contacts
+
+
+class TestContacts(BaseTest):
+    """ Compare the KD-tree contacts with a voxel-wise mask dilation. """
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        shape = (40, 60, 60)
+        # Membrane-like slab and random spherical clusters (ribosomes)
+        cls.mask = np.zeros(shape, dtype=bool)
+        cls.mask[18:21, :, :] = True
+        zz, yy, xx = np.indices(shape)
+        segmentation = np.zeros(shape, dtype=np.uint8)
+        for center in rng.integers([3, 3, 3], [37, 57, 57], size=(25, 3)):
+            dist2 = ((zz - center[0]) ** 2 + (yy - center[1]) ** 2
+                     + (xx - center[2]) ** 2)
+            segmentation[dist2 <= 4] = 1
+        cls.labels, cls.numClusters = contacts.labelClusters(segmentation)
+
+    def voxelContacts(self, distance):
+        """ Clusters touching the mask dilated with a ball of this radius. """
+        r = int(np.ceil(distance))
+        zz, yy, xx = np.indices((2 * r + 1,) * 3) - r
+        ball = zz ** 2 + yy ** 2 + xx ** 2 <= distance ** 2
+        dilated = ndimage.binary_dilation(self.mask, structure=ball)
+        return set(np.unique(self.labels[dilated])) - {0}
+
+    def inContact(self, mode, distance):
+        rows = contacts.computeContacts(self.labels, self.numClusters,
+                                        self.mask, mode=mode,
+                                        distance=distance)
+        self.assertEqual(len(rows), self.numClusters)
+        return {row[0] for row in rows if row[-1]}
+
+    def testIntersection(self):
+        self.assertEqual(self.inContact(contacts.INTERSECTION, 0),
+                         self.voxelContacts(0))
+
+    def testContact(self):
+        for distance in [1, 3, 6]:
+            self.assertEqual(self.inContact(contacts.CONTACT, distance),
+                             self.voxelContacts(distance))
+
+    def testColocalization(self):
+        distance = 5
+        rows = contacts.computeContacts(self.labels, self.numClusters,
+                                        self.mask, mode=contacts.COLOCALIZATION,
+                                        distance=distance)
+        maskDistance = ndimage.distance_transform_edt(~self.mask)
+        for row in rows:
+            x, y, z = row[2:5]
+            expected = maskDistance[int(round(z)), int(round(y)), int(round(x))]
+            self.assertAlmostEqual(row[7], expected, delta=1)
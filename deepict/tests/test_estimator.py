@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import os
+import shutil
+import tempfile
+
+from pyworkflow.tests import BaseTest
+
+from deepict import estimator
+
+
+class TestEstimator(BaseTest):
+
+    DIMS = {'tomo_1': (928, 928, 464),
+            'tomo_2': (40, 41, 1)}
+
+    def testCountPatches(self):
+        # Patches of 64^3 with an overlap of 12 cover 40 voxels per axis
+        self.assertEqual(estimator.countPatches((40, 40, 40)), 1)
+        self.assertEqual(estimator.countPatches((41, 40, 40)), 2)
+        self.assertEqual(estimator.countPatches((40, 41, 1)), 2)
+        self.assertEqual(estimator.countPatches((928, 928, 464)), 24 * 24 * 12)
+
+    def testDefaultThroughput(self):
+        estimate = estimator.estimateTomogram((928, 928, 464), {})
+        voxels = 928 * 928 * 464
+        patches = 24 * 24 * 12
+        expected = sum((voxels if units == estimator.VOXELS else patches)
+                       / estimator.DEFAULT_THROUGHPUT[stage]
+                       for stage, units in estimator.STAGE_UNITS.items())
+        self.assertAlmostEqual(estimate['seconds'], expected)
+        self.assertAlmostEqual(estimate['gpu_seconds'],
+                               patches / estimator.DEFAULT_THROUGHPUT[estimator.STAGE_SEGMENT])
+        self.assertEqual(estimate['ram_bytes'], voxels * estimator.DEFAULT_RAM_PER_VOXEL)
+        self.assertFalse(estimator.estimateRun(self.DIMS, {})['total']['calibrated'])
+
+    def testCalibratedThroughput(self):
+        calibration = {stage: {'units': 100, 'seconds': 1.0}
+                       for stage in estimator.STAGE_UNITS}
+        calibration[estimator.RAM_PER_VOXEL] = 2
+        estimate = estimator.estimateTomogram((40, 40, 40), calibration)
+        self.assertAlmostEqual(estimate['seconds'], (3 + 2 * 40 ** 3) / 100.0)
+        self.assertEqual(estimate['ram_bytes'], 2 * 40 ** 3)
+        self.assertTrue(estimator.estimateRun(self.DIMS, calibration)['total']['calibrated'])
+
+    def testTotals(self):
+        run = estimator.estimateRun(self.DIMS, {}, weightsBytes=1000)
+        tomos = run['tomograms'].values()
+        total = run['total']
+        self.assertEqual(total['tomograms'], 2)
+        for key in ['patches', 'seconds', 'scratch_bytes']:
+            self.assertAlmostEqual(total[key], sum(t[key] for t in tomos))
+        for key in ['ram_bytes', 'vram_bytes']:
+            self.assertEqual(total[key], max(t[key] for t in tomos))
+        self.assertAlmostEqual(total['gpu_hours'],
+                               sum(t['gpu_seconds'] for t in tomos) / 3600.0)
+        self.assertEqual(estimator.estimateRun({}, {})['total']['seconds'], 0)
+
+    def testRecordStage(self):
+        folder = tempfile.mkdtemp()
+        try:
+            calibrationFile = os.path.join(folder, 'calibration.json')
+            estimator.recordStage(calibrationFile, estimator.STAGE_SEGMENT, 100, 10.0, 1000)
+            estimator.recordStage(calibrationFile, estimator.STAGE_SEGMENT, 300, 10.0, 1000,
+                                  peakRss=4000)
+            # A stage that did not raise the children peak is not recorded
+            estimator.recordStage(calibrationFile, estimator.STAGE_SEGMENT, 0, 0.0, 10)
+            calibration = estimator.readCalibration(calibrationFile)
+            self.assertEqual(estimator.getThroughput(calibration, estimator.STAGE_SEGMENT), 20)
+            self.assertEqual(calibration[estimator.RAM_PER_VOXEL], 4)
+
+            # Not writable: the run must go on
+            estimator.recordStage(os.path.join(calibrationFile, 'calibration.json'),
+                                  estimator.STAGE_SEGMENT, 1, 1.0)
+        finally:
+            shutil.rmtree(folder)
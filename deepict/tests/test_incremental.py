@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import os
+import shutil
+import tempfile
+
+from pyworkflow.object import String
+from pyworkflow.tests import BaseTest, setupTestProject
+from tomo.objects import Tomogram
+
+from deepict import storage
+from deepict.protocols import DeepictSegmentation
+
+
+def writeFile(fileName, content):
+    with open(fileName, 'wb') as f:
+        f.write(content)
+
+
+class TestFingerprint(BaseTest):
+    """ Fingerprints depend on the tsId and the content, not on the path or
+    the modification time. """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # Larger than the sampled bytes (see TestFileFingerprint)
+        self.content = bytes(range(256)) * (8 * 4096)
+        self.fileName = os.path.join(self.folder, 'run1', 'tomo.mrc')
+        os.makedirs(os.path.dirname(self.fileName))
+        writeFile(self.fileName, self.content)
+        self.prot = self.newProtocol(DeepictSegmentation)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def getTomogram(self, fileName, tsId='tomo_1'):
+        tomogram = Tomogram()
+        tomogram.setLocation(fileName)
+        tomogram.setTsId(tsId)
+        return tomogram
+
+    def testSameContent(self):
+        fingerprint = self.prot.getFingerprint(self.getTomogram(self.fileName))
+        # Re-run upstream: new run folder and new modification time
+        copy = os.path.join(self.folder, 'run2', 'tomo.mrc')
+        os.makedirs(os.path.dirname(copy))
+        writeFile(copy, self.content)
+        os.utime(copy, (0, 0))
+        self.assertEqual(storage.fileFingerprint(copy), storage.fileFingerprint(self.fileName))
+        self.assertEqual(self.prot.getFingerprint(self.getTomogram(copy)), fingerprint)
+
+    def testChangedContent(self):
+        fingerprint = self.prot.getFingerprint(self.getTomogram(self.fileName))
+        self.assertNotEqual(self.prot.getFingerprint(self.getTomogram(self.fileName, 'tomo_2')),
+                            fingerprint)
+
+        for offset in [0, len(self.content) - 1]:
+            changed = bytearray(self.content)
+            changed[offset] ^= 0xFF
+            writeFile(self.fileName, bytes(changed))
+            self.assertNotEqual(self.prot.getFingerprint(self.getTomogram(self.fileName)),
+                                fingerprint)
+
+        writeFile(self.fileName, self.content + b'\0')
+        self.assertNotEqual(self.prot.getFingerprint(self.getTomogram(self.fileName)),
+                            fingerprint)
+
+
+    def testMissingFile(self):
+        os.remove(self.fileName)
+        with self.assertRaises(FileNotFoundError):
+            self.prot.getFingerprint(self.getTomogram(self.fileName))
+
+class TestPreviousOutputs(BaseTest):
+    """ Results of a previous run are reused only with the same weights and
+    post-processing parameters. """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+
+    def setUp(self):
+        self.previous = self.newProtocol(DeepictSegmentation,
+                                         tomogramOption=DeepictSegmentation.MEMBRANE)
+        self.previous.modelSha.set(self.previous.getSelectedModelSha())
+        tomogram = Tomogram()
+        tomogram.setTsId('tomo_1')
+        tomogram._deepictFingerprint = String('fingerprint')
+        setattr(self.previous, DeepictSegmentation.OUTPUT_TOMOGRAMS_NAME, [tomogram])
+
+        self.prot = self.newProtocol(DeepictSegmentation,
+                                     tomogramOption=DeepictSegmentation.MEMBRANE)
+        self.prot.previousRun.set(self.previous)
+
+    def testSameSignature(self):
+        self.assertEqual(self.prot.getPreviousOutputs(), {'tomo_1': 'fingerprint'})
+        self.assertEqual(self.prot._warnings(), [])
+
+    def testDifferentParameters(self):
+        self.prot.threshold.set(0.8)
+        self.assertEqual(self.prot.getPreviousOutputs(), {})
+        self.assertEqual(len(self.prot._warnings()), 1)
+
+    def testDifferentModel(self):
+        self.prot.tomogramOption.set(DeepictSegmentation.RIBOSOME)
+        self.assertEqual(self.prot.getPreviousOutputs(), {})
+
+    def testRetrainedCustomModel(self):
+        folder = tempfile.mkdtemp()
+        try:
+            weights = os.path.join(folder, 'custom.pth')
+            writeFile(weights, b'weights')
+            for prot in [self.previous, self.prot]:
+                prot.tomogramOption.set(DeepictSegmentation.CUSTOM)
+                prot.customModel.set(weights)
+            self.previous.modelSha.set(self.previous.getSelectedModelSha())
+            self.assertEqual(self.prot.getPreviousOutputs(), {'tomo_1': 'fingerprint'})
+
+            # Same path, new weights
+            writeFile(weights, b'retrained weights')
+            self.assertEqual(self.prot.getPreviousOutputs(), {})
+        finally:
+            shutil.rmtree(folder)
+
+    def testPreviousWithoutModel(self):
+        self.previous.modelSha.set(None)
+        self.assertEqual(self.prot.getPreviousOutputs(), {})
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import os
+import shutil
+import tempfile
+
+import mrcfile
+import numpy as np
+from pyworkflow.tests import BaseTest
+
+from deepict.viewers.lazy_volume import LazyVolume
+
+
+class TestLazyVolume(BaseTest):
+    """ Pyramid levels and slices of a synthetic volume with odd sizes. """
+
+    SHAPE = (65, 130, 257)
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.folder, 'tomo.mrc')
+        self.data = np.random.default_rng(0).random(self.SHAPE, dtype=np.float32)
+        with mrcfile.new(self.fileName) as mrc:
+            mrc.set_data(self.data)
+        self.cacheFolder = os.path.join(self.folder, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testLevels(self):
+        volume = LazyVolume(self.fileName, self.cacheFolder)
+        self.assertEqual(volume.shape, self.SHAPE)
+        self.assertEqual(volume.numLevels(), 3)
+        self.assertEqual(volume.getLevel(1).shape, (32, 65, 128))
+        self.assertEqual(volume.getLevel(2).shape, (16, 32, 64))
+
+        # Each voxel is the mean of its 2x2x2 block, the odd border is dropped
+        level1 = volume.getLevel(1)
+        for z, y, x in [(0, 0, 0), (31, 64, 127), (10, 33, 70)]:
+            block = self.data[2 * z:2 * z + 2, 2 * y:2 * y + 2, 2 * x:2 * x + 2]
+            self.assertAlmostEqual(float(level1[z, y, x]), float(block.mean()), places=5)
+        expected = np.asarray(level1[:32, :64, :128]).reshape(16, 2, 32, 2, 64, 2).mean(axis=(1, 3, 5))
+        self.assertTrue(np.allclose(volume.getLevel(2), expected, atol=1e-5))
+
+    def testSingleSection(self):
+        fileName = os.path.join(self.folder, 'flat.mrc')
+        with mrcfile.new(fileName) as mrc:
+            mrc.set_data(self.data[:1, :3])
+        volume = LazyVolume(fileName, self.cacheFolder)
+        level1 = volume.getLevel(1)
+        self.assertEqual(level1.shape, (1, 1, 128))
+        self.assertAlmostEqual(float(level1[0, 0, 5]),
+                               float(self.data[0, :2, 10:12].mean()), places=5)
+
+    def testGetSlice(self):
+        volume = LazyVolume(self.fileName, self.cacheFolder)
+        self.assertTrue(np.array_equal(volume.getSlice(0, 64), self.data[64]))
+        self.assertTrue(np.array_equal(volume.getSlice(2, 256), self.data[:, :, 256]))
+        level1 = volume.getLevel(1)
+        # Full resolution indexes map to index // 2, clamped to the last one
+        self.assertTrue(np.array_equal(volume.getSlice(1, 9, level=1), level1[:, 4]))
+        self.assertTrue(np.array_equal(volume.getSlice(0, 64, level=1), level1[31]))
+        self.assertTrue(np.array_equal(volume.getSlice(2, 256, level=1), level1[:, :, 127]))
+
+    def testSectionCache(self):
+        volume = LazyVolume(self.fileName, self.cacheFolder)
+        section = volume.getSlice(1, 20)
+        # The last section of each axis is not read again
+        self.assertIs(volume.getSlice(1, 20), section)
+        self.assertIsNot(volume.getSlice(1, 21), section)
+        self.assertIs(volume.getSlice(1, 20, level=1), volume.getSlice(1, 21, level=1))
+
+        volume.close()
+        self.assertTrue(np.array_equal(volume.getSlice(1, 20), self.data[:, 20]))
+        volume.close()
+
+    def testAutoLevel(self):
+        volume = LazyVolume(self.fileName, self.cacheFolder)
+        self.assertEqual(volume.autoLevel(displaySize=512), 0)
+        self.assertEqual(volume.autoLevel(displaySize=128), 1)
+        self.assertEqual(volume.autoLevel(displaySize=16), 2)
+
+    def testCache(self):
+        LazyVolume(self.fileName, self.cacheFolder).getLevel(2)
+        cached = sorted(os.listdir(self.cacheFolder))
+        self.assertEqual(len(cached), 2)
+        mtimes = [os.stat(os.path.join(self.cacheFolder, fn)).st_mtime_ns for fn in cached]
+
+        level2 = LazyVolume(self.fileName, self.cacheFolder).getLevel(2)
+        self.assertIsInstance(level2, np.memmap)
+        self.assertEqual(mtimes, [os.stat(os.path.join(self.cacheFolder, fn)).st_mtime_ns
+                                  for fn in cached])
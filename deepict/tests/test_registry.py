@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+
+from pyworkflow.tests import BaseTest
+
+import deepict
+from deepict.constants import MODEL_MEMBRANE
+from deepict.registry import ModelRegistry, sha256sum
+
+PACKAGED_MODELS = os.path.join(os.path.dirname(deepict.__file__), 'models')
+
+
+def writeWeights(fileName, content=b'weights'):
+    """ Fake torch checkpoint (a zip archive). """
+    with zipfile.ZipFile(fileName, 'w') as zf:
+        zf.writestr('archive/data.pkl', content)
+
+
+class TestModelRegistry(BaseTest):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.weights = os.path.join(self.folder, 'customModel.pth')
+        writeWeights(self.weights)
+        self.cacheFolder = os.path.join(self.folder, 'cache')
+        self.registry = ModelRegistry(os.path.join(self.folder, 'registry.json'),
+                                      [os.path.join(self.folder, 'models')])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testSha256sum(self):
+        with open(self.weights, 'rb') as f:
+            expected = hashlib.sha256(f.read()).hexdigest()
+        self.assertEqual(sha256sum(self.weights), expected)
+
+    def testRegister(self):
+        model = self.registry.register('custom', self.weights)
+        self.assertEqual(model['sha256'], sha256sum(self.weights))
+        # Persisted: a new registry instance sees the model
+        registry = ModelRegistry(self.registry.registryFile, self.registry.builtinFolders)
+        self.assertEqual(registry.getModel('custom')['sha256'], model['sha256'])
+        self.assertIn('membrane', registry.getModels())
+        with self.assertRaises(ValueError):
+            self.registry.register('membrane', self.weights)
+        self.assertEqual(registry.getCustomModels(), ['custom'])
+
+    def testRegisterNotWritable(self):
+        # The parent of the registry is a file, so it can never be written
+        registryFile = os.path.join(self.weights, 'registry.json')
+        registry = ModelRegistry(registryFile, self.registry.builtinFolders)
+        registry.register('custom', self.weights)
+        self.assertFalse(os.path.exists(registryFile))
+        self.assertIn('custom', registry.getModels())
+        self.assertTrue(os.path.exists(registry.cache('custom', self.cacheFolder)))
+
+    def testFindByFile(self):
+        self.assertIsNone(self.registry.findByFile(self.weights))
+        self.registry.register('custom', self.weights)
+        self.assertEqual(self.registry.findByFile(self.weights), 'custom')
+        relPath = os.path.relpath(self.weights)
+        self.assertEqual(self.registry.findByFile(relPath), 'custom')
+
+    def testCache(self):
+        self.registry.register('custom', self.weights)
+        cached = self.registry.cache('custom', self.cacheFolder)
+        self.assertEqual(os.path.basename(cached), 'customModel.pth')
+        self.assertEqual(sha256sum(cached), sha256sum(self.weights))
+
+        # A corrupted cached copy is replaced by a good one
+        with open(cached, 'r+b') as f:
+            f.write(b'XX')
+        self.assertEqual(self.registry.cache('custom', self.cacheFolder), cached)
+        self.assertEqual(sha256sum(cached), sha256sum(self.weights))
+
+    def testCacheNotWritable(self):
+        self.registry.register('custom', self.weights)
+        # The parent of the cache is a file (e.g. a folder of another user)
+        self.assertEqual(self.registry.cache('custom', os.path.join(self.weights, 'cache')),
+                         os.path.abspath(self.weights))
+
+        with open(self.weights, 'r+b') as f:
+            f.seek(40)
+            f.write(b'X')
+        with self.assertRaises(ValueError):
+            self.registry.cache('custom', os.path.join(self.weights, 'cache'))
+
+    def testCacheCorruptedSource(self):
+        self.registry.register('custom', self.weights)
+        stamp = os.stat(self.weights)
+        with open(self.weights, 'r+b') as f:
+            f.seek(40)
+            f.write(b'X')
+        os.utime(self.weights, ns=(stamp.st_atime_ns, stamp.st_mtime_ns))
+        self.assertFalse(self.registry.isStale('custom'))
+        with self.assertRaises(ValueError):
+            self.registry.cache('custom', self.cacheFolder)
+        self.assertEqual(os.listdir(os.path.join(self.cacheFolder, os.listdir(self.cacheFolder)[0])), [])
+
+    def testRetrainedModel(self):
+        self.registry.register('custom', self.weights)
+        oldCached = self.registry.cache('custom', self.cacheFolder)
+        writeWeights(self.weights, b'retrained weights')
+        self.assertTrue(self.registry.isStale('custom'))
+        self.registry.register('custom', self.weights)
+        self.assertFalse(self.registry.isStale('custom'))
+        cached = self.registry.cache('custom', self.cacheFolder)
+        self.assertNotEqual(cached, oldCached)
+        self.assertEqual(sha256sum(cached), sha256sum(self.weights))
+
+    def testBuiltinModel(self):
+        # Other weights with the name of a built-in model in another folder
+        otherFolder = os.path.join(self.folder, 'models')
+        os.makedirs(otherFolder)
+        writeWeights(os.path.join(otherFolder, 'membraneModel.pth'))
+
+        registry = ModelRegistry(self.registry.registryFile, [PACKAGED_MODELS, otherFolder])
+        model = registry.getModel(MODEL_MEMBRANE)
+        self.assertEqual(model['file'], os.path.join(PACKAGED_MODELS, 'membraneModel.pth'))
+        self.assertEqual(sha256sum(registry.cache(MODEL_MEMBRANE, self.cacheFolder)),
+                         model['sha256'])
+
+        registry = ModelRegistry(self.registry.registryFile, [otherFolder])
+        with self.assertRaisesRegex(ValueError, 'reinstall the plugin'):
+            registry.cache(MODEL_MEMBRANE, os.path.join(self.folder, 'otherCache'))
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import os
+import shutil
+import tempfile
+
+from pyworkflow.tests import BaseTest
+
+from deepict import storage
+from deepict.constants import POST_PROCESSED_FN, PROBABILITY_MAP_FN
+
+PRED_FOLDER = os.path.join('predictions', 'membraneModel', 'tomo_1', 'memb')
+INTERMEDIATE = ['config.yaml', 'data.csv', 'match_spectrum_filt.mrc',
+                os.path.join('tomo_1', 'partition.h5')]
+FINAL = [os.path.join(PRED_FOLDER, POST_PROCESSED_FN),
+         os.path.join(PRED_FOLDER, 'motl_1.csv'),
+         os.path.join(PRED_FOLDER, 'cluster_distances.csv')]
+PROBABILITY = [os.path.join(PRED_FOLDER, PROBABILITY_MAP_FN)]
+
+
+class TestRetention(BaseTest):
+    """ Files kept by each retention policy, with and without scratch. """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.outputFolder = os.path.join(self.folder, 'extra', 'tomo_1')
+        self.scratchFolder = os.path.join(self.folder, 'scratch', 'tomo_1')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def createWorkFolder(self, workFolder):
+        for relPath in INTERMEDIATE + FINAL + PROBABILITY:
+            path = os.path.join(workFolder, relPath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(relPath)
+
+    def listFiles(self, folder):
+        return {os.path.relpath(os.path.join(root, fn), folder)
+                for root, dirs, files in os.walk(folder) for fn in files}
+
+    def retain(self, policy, workFolder):
+        self.createWorkFolder(workFolder)
+        keep = storage.getRetainedFiles(workFolder, os.path.join(workFolder, PRED_FOLDER),
+                                        policy)
+        storage.retainFiles(workFolder, self.outputFolder, keep)
+        return self.listFiles(self.outputFolder)
+
+    def checkPolicies(self, workFolder):
+        expected = {storage.KEEP_ALL: INTERMEDIATE + FINAL + PROBABILITY,
+                    storage.KEEP_FINAL: FINAL,
+                    storage.KEEP_PROBABILITY: FINAL + PROBABILITY}
+        for policy, files in expected.items():
+            self.assertEqual(self.retain(policy, workFolder), set(files))
+            with open(os.path.join(self.outputFolder, FINAL[0])) as f:
+                self.assertEqual(f.read(), FINAL[0])
+            if workFolder != self.outputFolder:
+                self.assertFalse(os.path.exists(workFolder))
+            shutil.rmtree(self.outputFolder)
+
+    def testWithoutScratch(self):
+        self.checkPolicies(self.outputFolder)
+
+    def testWithScratch(self):
+        self.checkPolicies(self.scratchFolder)
+
+    def testEmptyFoldersRemoved(self):
+        self.createWorkFolder(self.outputFolder)
+        keep = storage.getRetainedFiles(self.outputFolder,
+                                        os.path.join(self.outputFolder, PRED_FOLDER),
+                                        storage.KEEP_FINAL)
+        storage.retainFiles(self.outputFolder, self.outputFolder, keep)
+        self.assertFalse(os.path.exists(os.path.join(self.outputFolder, 'tomo_1')))
+
+
+class TestCopyRetained(BaseTest):
+    """ Files of an unchanged tomogram copied from a previous run. """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.previousFolder = os.path.join(self.folder, 'previous', 'tomo_1')
+        self.outputFolder = os.path.join(self.folder, 'extra', 'tomo_1')
+        # Same weights saved with another file name
+        self.outputPredFolder = os.path.join(self.outputFolder, 'predictions', 'custom',
+                                             'tomo_1', 'memb')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def createPrevious(self, files):
+        for relPath in files:
+            path = os.path.join(self.previousFolder, relPath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(relPath)
+
+    def copy(self, policy):
+        storage.copyRetainedFiles(self.previousFolder,
+                                  os.path.join(self.previousFolder, PRED_FOLDER),
+                                  self.outputFolder, self.outputPredFolder, policy)
+        files = {os.path.relpath(os.path.join(root, fn), self.outputFolder)
+                 for root, dirs, files in os.walk(self.outputFolder) for fn in files}
+        shutil.rmtree(self.outputFolder)
+        return files
+
+    def predFiles(self, files):
+        return {os.path.relpath(os.path.join(self.outputPredFolder, os.path.basename(fn)),
+                                self.outputFolder) for fn in files}
+
+    def testPolicies(self):
+        self.createPrevious(INTERMEDIATE + FINAL + PROBABILITY)
+        self.assertEqual(self.copy(storage.KEEP_FINAL), self.predFiles(FINAL))
+        self.assertEqual(self.copy(storage.KEEP_PROBABILITY),
+                         self.predFiles(FINAL + PROBABILITY))
+        self.assertEqual(self.copy(storage.KEEP_ALL),
+                         set(INTERMEDIATE) | self.predFiles(FINAL + PROBABILITY))
+        # The previous run is not modified
+        self.assertEqual(len(os.listdir(os.path.join(self.previousFolder, PRED_FOLDER))), 4)
+
+    def testPreviousKeptLess(self):
+        self.createPrevious(FINAL)
+        self.assertEqual(self.copy(storage.KEEP_PROBABILITY), self.predFiles(FINAL))
+
+
+class TestFileFingerprint(BaseTest):
+    """ Only the header and a few blocks of a large file are read. """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.folder, 'tomo.mrc')
+        # Several times larger than the sampled bytes
+        self.content = bytes(range(256)) * (8 * 4096)
+        self.write(self.content)
+        self.fingerprint = storage.fileFingerprint(self.fileName)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, content):
+        with open(self.fileName, 'wb') as f:
+            f.write(content)
+
+    def changed(self, offset):
+        content = bytearray(self.content)
+        content[offset] ^= 0xFF
+        self.write(bytes(content))
+        return storage.fileFingerprint(self.fileName) != self.fingerprint
+
+    def testSampling(self):
+        size = len(self.content)
+        sampled = storage.FINGERPRINT_HEADER + storage.FINGERPRINT_BLOCKS * storage.FINGERPRINT_BLOCK_SIZE
+        self.assertGreater(size, 4 * sampled)
+        step = (size - storage.FINGERPRINT_BLOCK_SIZE) // (storage.FINGERPRINT_BLOCKS - 1)
+
+        # Header, sampled blocks and last byte
+        for offset in [0, 100, step + 10, 7 * step + storage.FINGERPRINT_BLOCK_SIZE - 1,
+                       size - 1]:
+            self.assertTrue(self.changed(offset), offset)
+        # Between two sampled blocks
+        for offset in [storage.FINGERPRINT_BLOCK_SIZE + 10, 3 * step - 10]:
+            self.assertFalse(self.changed(offset), offset)
+
+        self.write(self.content + b'\0')
+        self.assertNotEqual(storage.fileFingerprint(self.fileName), self.fingerprint)
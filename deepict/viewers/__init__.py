@@ -2,4 +2,5 @@
 # **************************************************************************
 # Module to declare viewers
 # Find documentation here: https://scipion-em.github.io/docs/docs/developer/creating-a-viewer
-# **************************************************************************
\ No newline at end of file
+# **************************************************************************
+from .viewer_deepict import DeepictSegmentationViewer
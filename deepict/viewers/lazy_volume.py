@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import hashlib
+import os
+
+import mrcfile
+import numpy as np
+
+# Largest side (in pixels) of the slices shown with the automatic level
+DISPLAY_SIZE = 512
+
+
+class LazyVolume:
+    """ Memory-mapped mrc volume with a pyramid of downsampled levels.
+
+    Only the slices that are shown are read from the full resolution volume,
+    and the last section of each axis is kept so it is not read again.
+    Level n is downsampled by 2^n and it is built from level n-1 the first time
+    it is requested, reading a couple of sections at a time, and cached as a
+    .npy file so later views memory-map it directly.
+    """
+
+    def __init__(self, fileName, cacheFolder):
+        self.fileName = fileName
+        self.cacheFolder = cacheFolder
+        self._levels = {}
+        self._sections = {}
+        self._mrc = None
+        stat = os.stat(fileName)
+        key = '%s:%d:%d' % (os.path.abspath(fileName), stat.st_size,
+                            stat.st_mtime_ns)
+        self._cachePrefix = os.path.join(
+            cacheFolder, hashlib.sha1(key.encode()).hexdigest()[:16])
+
+    def getLevel(self, level=0):
+        """ Volume (z, y, x) of a pyramid level, as a read-only memmap. """
+        if level not in self._levels:
+            if level == 0:
+                self._mrc = mrcfile.mmap(self.fileName, mode='r', permissive=True)
+                self._levels[0] = self._mrc.data
+            else:
+                self._levels[level] = self._loadLevel(level)
+        return self._levels[level]
+
+    def _loadLevel(self, level):
+        cached = '%s_L%d.npy' % (self._cachePrefix, level)
+        if not os.path.exists(cached):
+            self._buildLevel(self.getLevel(level - 1), cached)
+        return np.load(cached, mmap_mode='r')
+
+    @staticmethod
+    def _buildLevel(previous, fileName):
+        nz, ny, nx = (max(1, d // 2) for d in previous.shape)
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        tmpFile = fileName + '.tmp%d.npy' % os.getpid()
+        out = np.lib.format.open_memmap(tmpFile, mode='w+', dtype=np.float32,
+                                        shape=(nz, ny, nx))
+        fy, fx = min(2, previous.shape[1]), min(2, previous.shape[2])
+        for z in range(nz):
+            block = np.asarray(previous[2 * z:2 * z + 2, :ny * fy, :nx * fx],
+                               dtype=np.float32)
+            out[z] = block.reshape(block.shape[0], ny, fy, nx, fx).mean(axis=(0, 2, 4))
+        out.flush()
+        del out
+        os.replace(tmpFile, fileName)
+
+    @property
+    def shape(self):
+        return self.getLevel(0).shape
+
+    def numLevels(self):
+        return max(1, int(np.log2(max(self.shape) / 64)) + 1)
+
+    def autoLevel(self, displaySize=DISPLAY_SIZE):
+        """ Coarsest level whose largest side is still above the display size. """
+        level = 0
+        while (level + 1 < self.numLevels()
+               and max(self.shape) // 2 ** (level + 1) >= displaySize):
+            level += 1
+        return level
+
+    def getSlice(self, axis, index, level=0):
+        """ Section of the volume orthogonal to an axis (0=z, 1=y, 2=x) at a
+        full resolution index. """
+        volume = self.getLevel(level)
+        index = min(index // 2 ** level, volume.shape[axis] - 1)
+        key, section = self._sections.get(axis, (None, None))
+        if key != (level, index):
+            section = np.asarray(np.take(volume, index, axis=axis))
+            self._sections[axis] = ((level, index), section)
+        return section
+
+    def close(self):
+        """ Release the memory maps (they are opened again when needed). """
+        self._levels.clear()
+        self._sections.clear()
+        if self._mrc is not None:
+            self._mrc.close()
+            self._mrc = None
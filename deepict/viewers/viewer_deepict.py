@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:     Daniel Prieto (daniel.prietof@estudiante.uam.es)
+# *
+# * your institution
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import os
+
+import numpy as np
+
+import pyworkflow.viewer as pwviewer
+
+from deepict.constants import PROBABILITY_MAP_FN
+from deepict.protocols import DeepictSegmentation
+from .lazy_volume import LazyVolume
+
+OVERLAY_SEGMENTATION = 'segmentation'
+OVERLAY_PROBABILITY = 'probability'
+OVERLAY_NONE = 'none'
+
+
+class DeepictSegmentationViewer(pwviewer.Viewer):
+    """ Orthogonal slices of the segmented tomograms with the segmentation or
+    the probability map overlaid. """
+    _label = 'viewer segmentation'
+    _environments = [pwviewer.DESKTOP_TKINTER]
+    _targets = [DeepictSegmentation]
+
+    def _visualize(self, obj, **kwargs):
+        if not getattr(obj, obj.OUTPUT_TOMOGRAMS_NAME, None):
+            return [self.errorMessage('The protocol has no output tomograms yet',
+                                      title='No output')]
+
+        inputFiles = {tomo.getTsId(): tomo.getFileName()
+                      for tomo in obj.inputTomogram.get()}
+        items = []
+        for tomo in getattr(obj, obj.OUTPUT_TOMOGRAMS_NAME):
+            segmentation = tomo.getFileName()
+            items.append((tomo.getTsId(), inputFiles.get(tomo.getTsId()),
+                          segmentation, self._getProbabilityMap(segmentation)))
+
+        return [SliceView(items, obj._getTmpPath('pyramids'))]
+
+    @staticmethod
+    def _getProbabilityMap(segmentation):
+        """ Probability map assembled by DeePiCt next to the segmentation
+        (only if it was retained). """
+        path = os.path.join(os.path.dirname(segmentation), PROBABILITY_MAP_FN)
+        return path if os.path.exists(path) else None
+
+
+class SliceView:
+    """ Matplotlib window to browse the tomograms of a segmentation. """
+
+    AXES = [(0, 'XY'), (1, 'XZ'), (2, 'YZ')]
+
+    def __init__(self, items, cacheFolder):
+        self.items = items
+        self.cacheFolder = cacheFolder
+        self._volumes = {}
+
+    def _getVolume(self, fileName):
+        if fileName not in self._volumes:
+            self._volumes[fileName] = LazyVolume(fileName, self.cacheFolder)
+        return self._volumes[fileName]
+
+    def _closeVolumes(self, keep=()):
+        """ Close the volumes of the tomograms that are no longer shown. """
+        for fileName in list(self._volumes):
+            if fileName not in keep:
+                self._volumes.pop(fileName).close()
+
+    def show(self):
+        import matplotlib.pyplot as plt
+        from matplotlib.widgets import Slider, RadioButtons
+
+        fig, self.axes = plt.subplots(1, 3, figsize=(15, 6))
+        fig.subplots_adjust(bottom=0.3, left=0.15)
+        self.fig = fig
+        self.index = 0
+        self.overlay = OVERLAY_SEGMENTATION
+        self.position = None
+        self.level = None
+
+        if len(self.items) > 1:
+            self.tomoSlider = Slider(fig.add_axes([0.25, 0.2, 0.6, 0.03]), 'Tomogram',
+                                     0, len(self.items) - 1, valinit=0, valstep=1)
+            self.tomoSlider.on_changed(self._onTomogram)
+        self.levelSlider = Slider(fig.add_axes([0.25, 0.15, 0.6, 0.03]), 'Level',
+                                  0, 5, valinit=0, valstep=1)
+        self.posSliders = [Slider(fig.add_axes([0.25, 0.1 - 0.035 * i, 0.6, 0.025]),
+                                  label, 0, 1, valinit=0.5)
+                           for i, label in enumerate(['Z', 'Y', 'X'])]
+        self.overlayButtons = RadioButtons(fig.add_axes([0.01, 0.05, 0.1, 0.15]),
+                                           [OVERLAY_SEGMENTATION, OVERLAY_PROBABILITY,
+                                            OVERLAY_NONE])
+
+        self.levelSlider.on_changed(self._onLevel)
+        for axis, slider in enumerate(self.posSliders):
+            slider.on_changed(lambda value, axis=axis: self._drawPanel(axis))
+        self.overlayButtons.on_clicked(self._onOverlay)
+        fig.canvas.mpl_connect('close_event', lambda event: self._closeVolumes())
+
+        self._onTomogram(0)
+        plt.show()
+
+    def _onTomogram(self, value):
+        self.index = min(int(value), len(self.items) - 1)
+        self._closeVolumes(keep=self.items[self.index])
+        tomogram = self._getVolume(self._getTomogramFile())
+        self.levelSlider.valmax = tomogram.numLevels() - 1
+        self.levelSlider.ax.set_xlim(0, self.levelSlider.valmax)
+        self.levelSlider.set_val(tomogram.autoLevel())
+
+    def _onLevel(self, value):
+        self.level = int(value)
+        self._draw()
+
+    def _onOverlay(self, label):
+        self.overlay = label
+        self._draw()
+
+    def _getTomogramFile(self):
+        tsId, tomogramFn, segmentationFn, probabilityFn = self.items[self.index]
+        # The segmentation is shown alone if the input is not available
+        return tomogramFn if tomogramFn and os.path.exists(tomogramFn) else segmentationFn
+
+    def _getOverlayFile(self):
+        tsId, tomogramFn, segmentationFn, probabilityFn = self.items[self.index]
+        if self.overlay == OVERLAY_SEGMENTATION:
+            return segmentationFn
+        if self.overlay == OVERLAY_PROBABILITY:
+            return probabilityFn
+        return None
+
+    def _draw(self):
+        """ Draw the three panels (new tomogram, level or overlay). """
+        if self.level is None:
+            return
+        for axis, _ in self.AXES:
+            self._drawPanel(axis, redraw=False)
+        self.fig.suptitle('%s - level %d' % (self.items[self.index][0], self.level))
+        self.fig.canvas.draw_idle()
+
+    def _drawPanel(self, axis, redraw=True):
+        """ Draw the section orthogonal to an axis at its slider position. """
+        if self.level is None:
+            return
+        tomogram = self._getVolume(self._getTomogramFile())
+        overlayFn = self._getOverlayFile()
+        overlay = self._getVolume(overlayFn) if overlayFn else None
+        shape = tomogram.shape
+
+        ax = self.axes[axis]
+        index = int(self.posSliders[axis].val * (shape[axis] - 1))
+        ax.clear()
+        ax.imshow(tomogram.getSlice(axis, index, self.level), cmap='gray')
+        if overlay is not None and overlay.shape == shape:
+            section = overlay.getSlice(axis, index, self.level)
+            ax.imshow(np.ma.masked_less_equal(section, 0), cmap='autumn',
+                      alpha=0.5, vmin=0, vmax=max(1e-6, float(section.max())))
+        ax.set_title('%s (%d)' % (self.AXES[axis][1], index))
+        ax.axis('off')
+        if redraw:
+            self.fig.canvas.draw_idle()
@@ -36,6 +36,6 @@ setup(
     install_requires=[requirements],
     entry_points={'pyworkflow.plugin': 'deepict = deepict'},
     package_data={  # Optional
-       'deepict': ['icon.png', 'protocols.conf'],
+       'deepict': ['icon.png', 'protocols.conf', 'models/*.pth'],
     }
 )